@@ -4,6 +4,12 @@
 
 __version__ = "1.8.0"
 
+import os
+# oneDNN optimizations (e.g. NHWC and BF16 brgconv kernels on x86 CPUs). They
+# must be set before TensorFlow is imported (by the submodules below)
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+os.environ.setdefault('TF_ENABLE_MKL_NATIVE_FORMAT', '1')
+
 BACKBONE_BLOCKS = [
     'convnet',          # plain convolutional block w/o skip connections
     'resnet',           # residual convolutional blocks
@@ -43,6 +49,7 @@ DROPOUT_VARIANTS = [
     'mcdrop',           # monte carlo (vanilla) dropout
     'mcgaussiandrop',   # monte carlo gaussian dropout
     'mcspatialdrop']    # monte carlo spatial dropout
+MC_DROPOUT_VARIANTS = ['mcdrop', 'mcgaussiandrop', 'mcspatialdrop']
 
 from .metrics import *
 from .inference import *
@@ -60,7 +60,7 @@ flags.DEFINE_bool('attention', False, 'Attention block in convolutional layers')
 flags.DEFINE_enum('activation', 'relu', ['elu', 'relu', 'gelu', 'crelu', 'leaky_relu', 'selu'], 'Activation used in intermediate convolutional blocks')
 flags.DEFINE_enum('output_activation', None, ['elu', 'relu', 'gelu', 'crelu', 'leaky_relu', 'selu'], 'Activation used in the last convolutional block')
 flags.DEFINE_bool('localcon_layer', False, 'Locally connected convolutional layer')
-flags.DEFINE_enum('decoder_upsampling', 'rc', UPSAMPLING_METHODS, 'Upsampling in decoder blocks (unet backbone)')
+flags.DEFINE_enum('decoder_upsampling', 'spc', UPSAMPLING_METHODS, 'Upsampling in decoder blocks (unet backbone)')
 flags.DEFINE_enum('rc_interpolation', 'bilinear', INTERPOLATION_METHODS, 'Interpolation used in resize convolution upsampling')
 
 ### TRAINING PROCEDURE
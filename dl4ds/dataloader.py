@@ -386,7 +386,8 @@ class DataGenerator(tf.keras.utils.Sequence):
         static_vars=None, 
         predictors=None,
         interpolation='inter_area',
-        repeat=None
+        repeat=None,
+        fused_input=False
         ):
         """
         Parameters
@@ -418,6 +419,10 @@ class DataGenerator(tf.keras.utils.Sequence):
         repeat : int or None, optional
             Factor to repeat the samples in ``array``. Useful when ``patch_size``
             is not None.
+        fused_input : bool, optional
+            If True, the HR auxiliary array is concatenated to the LR array 
+            along the channels dimension and each batch has a single input, 
+            for models built with ``fused_input=True`` (see ``net_pin``).
 
         TO-DO
         -----
@@ -454,6 +459,7 @@ class DataGenerator(tf.keras.utils.Sequence):
             self.predictors = np.concatenate(self.predictors, axis=-1)
         self.interpolation = interpolation
         self.repeat = repeat
+        self.fused_input = fused_input
         
         # shuffling the order of the available indices (n samples)
         if self.time_window is not None:
@@ -502,9 +508,59 @@ class DataGenerator(tf.keras.utils.Sequence):
             interpolation=self.interpolation,
             time_metadata=self.time_metadata)
 
+        if self.fused_input:
+            (batch_lr, *batch_aux_hr), batch_hr = res
+            if batch_aux_hr:
+                batch_lr = np.concatenate([batch_lr, batch_aux_hr[0]], axis=-1)
+            res = [batch_lr], batch_hr
         return res
 
 
+def make_dataset(x, s=None, y=None, batch_size=64, dtype='float32', 
+                 device=None):
+    """
+    Create a tf.data pipeline for feeding the models (e.g. to ``model.fit`` or 
+    ``model.predict``). The input batches are cast to ``dtype`` and prefetched,
+    so that the host-to-device copies overlap with the computation of the 
+    previous batch.
+
+    Parameters
+    ----------
+    x : np.ndarray or tf.Tensor
+        Input samples with dims [nsamples, lat, lon, vars].
+    s : np.ndarray, tf.Tensor or None, optional
+        HR auxiliary variables with dims [nsamples, lat, lon, vars], fed to the
+        second input of the model.
+    y : np.ndarray, tf.Tensor or None, optional
+        Target samples. If None, only the inputs are yielded (for inference).
+    batch_size : int, optional
+        Batch size.
+    dtype : str, optional
+        Data type of the input batches. 'float16' or 'bfloat16' halve the size 
+        of the host-to-device copies when using mixed precision.
+    device : str or None, optional
+        If not None (e.g. '/GPU:0'), the batches are copied to this device with 
+        ``tf.data.experimental.copy_to_device`` and prefetched there.
+    """
+    inputs = (x,) if s is None else (x, s)
+    elements = (inputs,) if y is None else (inputs, y)
+
+    def cast_inputs(inputs, *targets):
+        inputs = tuple(tf.cast(t, dtype) for t in inputs)
+        return (inputs,) + targets
+
+    ds = tf.data.Dataset.from_tensor_slices(elements)
+    ds = ds.batch(batch_size)
+    ds = ds.map(cast_inputs, num_parallel_calls=tf.data.AUTOTUNE)
+    if device is not None:
+        ds = ds.apply(tf.data.experimental.copy_to_device(device))
+        with tf.device(device):
+            ds = ds.prefetch(tf.data.AUTOTUNE)
+    else:
+        ds = ds.prefetch(tf.data.AUTOTUNE)
+    return ds
+
+
 def _get_season_(time_metadata, time_window):
     """ Get the season for a given sample.
     """
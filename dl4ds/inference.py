@@ -1,12 +1,13 @@
 from datetime import time
 import os
+import tempfile
 import numpy as np
 import xarray as xr
 import tensorflow as tf
 import keras
 
 from .utils import Timing, checkarray_ndim, resize_array, spatiotemporal_to_spatial_samples
-from .dataloader import create_batch_hr_lr
+from .dataloader import create_batch_hr_lr, make_dataset
 
 
 class Predictor():
@@ -228,14 +229,19 @@ def predict(
     x_test_lr = tf.cast(x_test_lr, tf.float32)   
     if static_vars is not None: 
         aux_vars_hr = tf.cast(batch_aux_hr, tf.float32) 
-        inputs = [x_test_lr, aux_vars_hr]
+        if len(model.inputs) == 1:
+            # model with a single (fused) input, see ``fused_input`` in net_pin
+            x_test_lr = tf.concat([x_test_lr, aux_vars_hr], axis=-1)
+            aux_vars_hr = None
     else:
-        inputs = [x_test_lr]
+        aux_vars_hr = None
+    # batched and prefetched input pipeline
+    inputs = make_dataset(x_test_lr, aux_vars_hr, batch_size=batch_size)
     
     ### Inference --------------------------------------------------------------
     # https://www.tensorflow.org/api_docs/python/tf/keras/Model#predict
     with tf.device('/' + device + ':0'):
-        out = model.predict(inputs, batch_size=batch_size, verbose=1)
+        out = model.predict(inputs, verbose=1)
     
     ### 
     if out.ndim == 5 and time_window is not None:
@@ -254,3 +260,147 @@ def predict(
     else:
         return out        
     
+
+
+def to_int8(model, representative_dataset, save_path=None, 
+            float_output_block=True):
+    """Post-training int8 quantization of a trained model (e.g., built by 
+    ``net_pin`` or ``unet_pin``) with TensorFlow Lite. Weights and activations 
+    are quantized to int8, so the convolutions run on int8 kernels (e.g., VNNI
+    on CPUs). The model inputs and output stay in float32 (they are quantized
+    and dequantized at the boundaries). 
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained model. Static input shapes (e.g., ``localcon_layer=True``) are
+        preferred for the TFLite conversion.
+    representative_dataset : callable
+        Generator function yielding lists of float32 arrays, one per model input
+        and with a batch dimension, used to calibrate the activation ranges. 
+    save_path : str or None, optional
+        If not None, the TFLite flatbuffer is saved to this path. 
+    float_output_block : bool, optional
+        If True, the ops of the output block (the last layer with weights, e.g.
+        the last ``ConvBlock``) are excluded from the quantization and run in 
+        float32, preserving the range of the regression output. The rest of the
+        model is selectively quantized with TFLite's quantization debugger. If
+        False, all the ops are quantized to int8, including the output block.
+
+    Returns
+    -------
+    tflite_model : bytes
+        Serialized TFLite model, to be run with ``tf.lite.Interpreter``.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+
+    if float_output_block:
+        # int8 ops with float fallback, for the ops of the output block
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+        output_block = [layer for layer in model.layers if layer.weights][-1]
+        # the TFLite tensor names are prefixed by the keras layer names
+        float_model = tf.lite.TFLiteConverter.from_keras_model(model).convert()
+        interpreter = tf.lite.Interpreter(model_content=float_model)
+        denylisted_nodes = [
+            tensor['name'] for tensor in interpreter.get_tensor_details() 
+            if output_block.name + '/' in tensor['name']]
+        debug_options = tf.lite.experimental.QuantizationDebugOptions(
+            denylisted_nodes=denylisted_nodes)
+        debugger = tf.lite.experimental.QuantizationDebugger(
+            converter=converter, 
+            debug_dataset=representative_dataset,
+            debug_options=debug_options)
+        tflite_model = debugger.get_nodes_quantized_model()
+    else:
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        tflite_model = converter.convert()
+
+    if save_path is not None:
+        with open(save_path, 'wb') as f:
+            f.write(tflite_model)
+    return tflite_model
+
+
+def to_trt(
+    model, 
+    hr_size=None, 
+    precision='FP16', 
+    max_batch=8, 
+    save_path=None, 
+    calibration_input_fn=None):
+    """TF-TRT conversion of a trained model (e.g., built by ``net_pin`` or 
+    ``unet_pin``) for GPU inference. TensorRT fuses the convolutional layers 
+    and runs them on cuDNN/cuBLASLt kernels (Tensor Cores for FP16/INT8). The
+    engines are pre-built for inputs of size [max_batch, H, W, C].
+
+    Parameters
+    ----------
+    model : tf.keras.Model
+        Trained model.
+    hr_size : tuple or None, optional
+        Height and width of the HR grid, used to build the engines when the 
+        model has dynamic (None, None) spatial inputs.
+    precision : str, optional
+        Precision mode, one of 'FP32', 'FP16' or 'INT8'.
+    max_batch : int, optional
+        Batch size of the inputs used to pre-build the engines.
+    save_path : str or None, optional
+        Directory where the converted SavedModel is saved. If None, it is 
+        saved in a new temporary directory (``tempfile.mkdtemp``), which is 
+        not removed since the returned model is loaded from it. 
+    calibration_input_fn : callable or None, optional
+        Generator function yielding tuples of input arrays (one per model 
+        input), used for the INT8 calibration. Required when 
+        ``precision='INT8'``.
+
+    Returns
+    -------
+    trt_model : SavedModel 
+        Loaded converted model, to be called through 
+        ``trt_model.signatures['serving_default']``.
+    """
+    precision = precision.upper()
+    if precision not in ['FP32', 'FP16', 'INT8']:
+        raise ValueError(f"`precision` must be one of ['FP32', 'FP16', 'INT8'], got {precision}")
+    if precision == 'INT8' and calibration_input_fn is None:
+        raise ValueError('`calibration_input_fn` must be provided for INT8 precision')
+
+    input_shapes = []
+    for model_input in model.inputs:
+        shape = model_input.shape.as_list()[1:]
+        if shape[0] is None or shape[1] is None:
+            if hr_size is None:
+                msg = '`hr_size` must be provided for models with dynamic spatial inputs'
+                raise ValueError(msg)
+            shape = list(hr_size) + shape[2:]
+        input_shapes.append([max_batch] + shape)
+
+    if save_path is None:
+        save_path = tempfile.mkdtemp(prefix='model_trt_')
+
+    conversion_params = tf.experimental.tensorrt.ConversionParams(
+        precision_mode=precision, 
+        max_workspace_size_bytes=1 << 30,
+        use_calibration=precision == 'INT8')
+
+    def input_fn():
+        yield tuple(np.zeros(shape, dtype='float32') for shape in input_shapes)
+
+    # the intermediate SavedModel is removed once the converted one is saved
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_saved_model_dir = os.path.join(tmp_dir, 'model')
+        model.save(input_saved_model_dir, save_format='tf')
+        converter = tf.experimental.tensorrt.Converter(
+            input_saved_model_dir=input_saved_model_dir, 
+            conversion_params=conversion_params)
+        if precision == 'INT8':
+            converter.convert(calibration_input_fn=calibration_input_fn)
+        else:
+            converter.convert()
+        # building the engines ahead of time, instead of at the first call
+        converter.build(input_fn=input_fn)
+        converter.save(save_path)
+    return tf.saved_model.load(save_path)
@@ -4,12 +4,18 @@ from tensorflow.keras.layers import (Add, Conv2D, ConvLSTM2D, Concatenate,
                                      LayerNormalization, Activation, 
                                      Dropout, GaussianDropout,
                                      SpatialDropout2D, Conv2DTranspose, 
-                                     SpatialDropout3D, LocallyConnected2D,
-                                     ZeroPadding2D, MaxPooling2D, Resizing,
+                                     SpatialDropout3D,
+                                     MaxPooling2D,
                                      DepthwiseConv2D, Dense, Lambda)
 from ..utils import checkarg_dropout_variant
 
 
+# Explicit NHWC layout, the one selected by the fast oneDNN (CPU) and cuDNN 
+# Tensor Core (GPU) convolution kernels. Blocks such as ChannelAttention2D or 
+# the subpixel convolution assume channels-last tensors
+DATA_FORMAT = 'channels_last'
+
+
 class ConvBlock(tf.keras.layers.Layer): 
     """
     Convolutional block.
@@ -38,12 +44,14 @@ class ConvBlock(tf.keras.layers.Layer):
                 padding='same', 
                 strides=strides, 
                 use_bias=True if self.normalization is None else False,
+                data_format=DATA_FORMAT,
                 **conv_kwargs)
             self.conv2 = SeparableConv2D(
                 filters, 
                 kernel_size=ks_cl2, 
                 padding='same', 
                 use_bias=True if self.normalization is None else False,
+                data_format=DATA_FORMAT,
                 **conv_kwargs)
         else:
             self.conv1 = Conv2D(
@@ -52,12 +60,14 @@ class ConvBlock(tf.keras.layers.Layer):
                 padding='same', 
                 strides=strides, 
                 use_bias=True if self.normalization is None else False,
+                data_format=DATA_FORMAT,
                 **conv_kwargs)
             self.conv2 = Conv2D(
                 filters, 
                 kernel_size=ks_cl2, 
                 padding='same', 
                 use_bias=True if self.normalization is None else False,
+                data_format=DATA_FORMAT,
                 **conv_kwargs)
 
         if self.normalization is not None:
@@ -144,7 +154,8 @@ class ConvNextBlock(tf.keras.layers.Layer):
         self.drop_path = drop_path
         self.layer_scale_init_value = layer_scale_init_value
         self.dwconv = DepthwiseConv2D(kernel_size=7, padding='same', 
-                                      depth_multiplier=1, **conv_kwargs)
+                                      depth_multiplier=1, 
+                                      data_format=DATA_FORMAT, **conv_kwargs)
         self.normalization = normalization
         self.pwconv1 = Dense(4 * self.filters)
         self.activation = Activation(activation)
@@ -161,7 +172,8 @@ class ConvNextBlock(tf.keras.layers.Layer):
             self.norm = LayerNormalization(epsilon=1e-6)
 
         if self.use_1x1conv:
-            self.conv1x1 = Conv2D(self.filters, kernel_size=1, strides=1)
+            self.conv1x1 = Conv2D(self.filters, kernel_size=1, strides=1, 
+                                  data_format=DATA_FORMAT)
 
     def build(self, input_shape):
         self.gamma = tf.Variable(
@@ -205,7 +217,8 @@ class ResidualBlock(ConvBlock):
                          dropout_variant, name=name, **conv_kwargs)
         self.use_1x1conv = use_1x1conv
         if self.use_1x1conv:
-            self.conv1x1 = Conv2D(filters, kernel_size=1, strides=1)
+            self.conv1x1 = Conv2D(filters, kernel_size=1, strides=1, 
+                                  data_format=DATA_FORMAT)
 
     def call(self, X):
         if self.apply_dropout:
@@ -234,28 +247,38 @@ class DenseBlock(ConvBlock):
     """
     Dense block.
 
+    If ``concat_input`` is False, only the new feature maps are returned (not 
+    concatenated to the input), e.g. for a one-shot aggregation of the outputs
+    of several blocks [2].
+
     References
     ----------
     [1] Gao Huang, Zhuang Liu, Laurens van der Maaten, Kilian Q. Weinberger
         Densely Connected Convolutional Networks: 
         https://arxiv.org/abs/1608.06993
+    [2] An Energy and GPU-Computation Efficient Backbone Network for Real-Time
+        Object Detection: https://arxiv.org/abs/1904.09730
     """
     def __init__(self, filters, strides=1, ks_cl1=(1,1), ks_cl2=(3,3), 
                  activation='relu', normalization=None, attention=False, 
-                 dropout_rate=0, dropout_variant=None, name=None, **conv_kwargs):
+                 dropout_rate=0, dropout_variant=None, concat_input=True, 
+                 name=None, **conv_kwargs):
         super().__init__(filters, strides, ks_cl1, ks_cl2, activation, 
                          normalization, attention, dropout_rate, 
                          dropout_variant, name=name, **conv_kwargs)
+        self.concat_input = concat_input
         self.conv1 = Conv2D(
             4 * filters, 
             padding='same', 
             kernel_size=ks_cl1, 
             strides=strides, 
+            data_format=DATA_FORMAT,
             **conv_kwargs)
         self.conv2 = Conv2D(
             filters, 
             kernel_size=ks_cl2, 
             padding='same', 
+            data_format=DATA_FORMAT,
             **conv_kwargs)
         self.concat = Concatenate()
 
@@ -273,7 +296,8 @@ class DenseBlock(ConvBlock):
         Y = self.conv2(Y)
         if self.attention:
             Y = self.att(Y)
-        Y = self.concat([Y, X])
+        if self.concat_input:
+            Y = self.concat([Y, X])
         return Y
 
 
@@ -282,6 +306,10 @@ class TransitionBlock(tf.keras.layers.Layer):
     Transition layer to control the complexity of the model by using 1x1 
     convolutions. Used in architectures, such as the Densenet.
 
+    With ``groups`` > 1, the 1x1 convolution is grouped (both the input channels
+    and ``filters`` must be divisible by ``groups``), dividing its FLOPs and 
+    weights by ``groups``.
+
     References
     ----------
     [1] Gao Huang, Zhuang Liu, Laurens van der Maaten, Kilian Q. Weinberger
@@ -289,14 +317,15 @@ class TransitionBlock(tf.keras.layers.Layer):
         https://arxiv.org/abs/1608.06993
     """
     def __init__(self, filters, activation='relu', normalization=None, 
-                 name=None, **kwargs):
+                 groups=1, name=None, **kwargs):
         super().__init__(name=name, **kwargs)
         if normalization is not None and normalization == 'bn':
             self.batch_norm = BatchNormalization()
         else:
             self.batch_norm = None
         self.activation = Activation(activation)
-        self.conv = Conv2D(filters, kernel_size=1)
+        self.conv = Conv2D(filters, kernel_size=1, groups=groups, 
+                           data_format=DATA_FORMAT)
 
     def call(self, X):
         if self.batch_norm is not None:
@@ -313,24 +342,45 @@ class LocalizedConvBlock(tf.keras.layers.Layer):
     """ 
     Localized convolutional block through a locally connected layer (1x1 kernel) 
     with biases.
+
+    The per-pixel kernel and biases are plain variables of shape (h, w, filters,
+    filters) and (h, w, filters), allocated in ``build`` from the static input 
+    shape, and the 1x1 locally connected product is a single einsum (no sparse
+    gather/scatter ops as in LocallyConnected2D).
     """
     def __init__(self, filters=2, activation=None, use_bias=True, 
                  name_sufix='', **kwargs):
         super().__init__(name='LocalizedConvBlock' + name_sufix, **kwargs)
         self.filters = filters
+        self.use_bias = use_bias
+        self.activation = tf.keras.activations.get(activation)
         self.transition = TransitionBlock(filters=filters)
-        self.localconv = LocallyConnected2D(
-            filters=filters,
-            kernel_size=(1, 1),
-            implementation=3,
-            bias_initializer='zeros',
-            use_bias=use_bias,
-            activation=activation)
+
+    def build(self, input_shape):
+        h, w = input_shape[1], input_shape[2]
+        if h is None or w is None:
+            raise ValueError('LocalizedConvBlock requires a static input shape')
+        # same glorot uniform scale as the 1-D kernel of LocallyConnected2D 
+        # (implementation=3), whose fans are both h * w * filters * filters
+        limit = (3 / (h * w * self.filters * self.filters)) ** 0.5
+        self.kernel = self.add_weight(
+            name='kernel', shape=(h, w, self.filters, self.filters),
+            initializer=tf.keras.initializers.RandomUniform(-limit, limit),
+            trainable=True)
+        if self.use_bias:
+            self.bias = self.add_weight(
+                name='bias', shape=(h, w, self.filters), initializer='zeros',
+                trainable=True)
+        else:
+            self.bias = None
+        super().build(input_shape)
 
     def call(self, X):
         Y = self.transition(X)
-        Y = self.localconv(Y)
-        return Y
+        Y = tf.einsum('bhwc,hwcf->bhwf', Y, self.kernel)
+        if self.bias is not None:
+            Y = Y + self.bias
+        return self.activation(Y)
 
     def compute_output_shape(self, input_shape):
         return (input_shape[0], input_shape[1], input_shape[2], self.filters)
@@ -411,9 +461,12 @@ class SubpixelConvolutionBlock(tf.keras.layers.Layer):
         super().__init__(name='SubpixelConvolution' + name_suffix)
         self.scale = scale
         self.n_filters = n_filters
-        self.conv = Conv2D(self.n_filters * (self.scale ** 2), 3, padding='same', **kwargs)
-        self.conv2x = Conv2D(self.n_filters * (2 ** 2), 3, padding='same', **kwargs)
-        self.conv5x = Conv2D(self.n_filters * (5 ** 2), 3, padding='same', **kwargs)
+        self.conv = Conv2D(self.n_filters * (self.scale ** 2), 3, padding='same', 
+                           data_format=DATA_FORMAT, **kwargs)
+        self.conv2x = Conv2D(self.n_filters * (2 ** 2), 3, padding='same', 
+                             data_format=DATA_FORMAT, **kwargs)
+        self.conv5x = Conv2D(self.n_filters * (5 ** 2), 3, padding='same', 
+                             data_format=DATA_FORMAT, **kwargs)
 
     def upsample_conv(self, x, factor):
         """Sub-pixel convolution (pixel shuffle)
@@ -476,7 +529,8 @@ class ResizeConvolutionBlock(tf.keras.layers.Layer):
         self.scale = scale
         self.n_filters = n_filters
         self.interpolation = interpolation
-        self.conv = Conv2D(self.n_filters, 3, padding='same', **kwargs)
+        self.conv = Conv2D(self.n_filters, 3, padding='same', 
+                           data_format=DATA_FORMAT, **kwargs)
 
     def compute_output_shape(self, input_shape):
         return (input_shape[0], int(input_shape[1] * self.scale), 
@@ -486,7 +540,7 @@ class ResizeConvolutionBlock(tf.keras.layers.Layer):
         input_shape = x.shape
         height = int(input_shape[1] * self.scale)
         width = int(input_shape[2] * self.scale)
-        y = Resizing(height, width, interpolation=self.interpolation)(x)
+        y = tf.image.resize(x, (height, width), method=self.interpolation)
         y = self.conv(y)
         return y
 
@@ -506,14 +560,17 @@ class DeconvolutionBlock(tf.keras.layers.Layer):
         self.scale = scale
         self.output_activation = output_activation
         self.conv2dtranspose1 = Conv2DTranspose(n_filters, (9, 9), strides=(2, 2), 
-            padding='same', name='deconv_1of2_scale_x2', use_bias=False)
+            padding='same', name='deconv_1of2_scale_x2', use_bias=False, 
+            data_format=DATA_FORMAT)
         self.conv2dtranspose2 = Conv2DTranspose(n_filters, (9, 9), strides=(2, 2), 
             padding='same', name='deconv_2of2_scale_x2', 
-            activation=output_activation, use_bias=False)
+            activation=output_activation, use_bias=False, 
+            data_format=DATA_FORMAT)
         self.conv2dtranspose = Conv2DTranspose(n_filters, (9, 9), 
             strides=(self.scale, self.scale), padding='same', 
             name='deconv_scale_x' + str(self.scale), 
-            activation=output_activation, use_bias=False)
+            activation=output_activation, use_bias=False, 
+            data_format=DATA_FORMAT)
 
     def compute_output_shape(self, input_shape):
         return (input_shape[0], int(input_shape[1] * self.scale), 
@@ -579,8 +636,10 @@ class ChannelAttention2D(tf.keras.layers.Layer):
         super().__init__(**kwargs)
         self.nf = nf
         self.r = r
-        self.conv1 = Conv2D(filters=int(nf/r), kernel_size=1, use_bias=True)
-        self.conv2 = Conv2D(filters=nf, kernel_size=1, use_bias=True)
+        self.conv1 = Conv2D(filters=int(nf/r), kernel_size=1, use_bias=True, 
+                            data_format=DATA_FORMAT)
+        self.conv2 = Conv2D(filters=nf, kernel_size=1, use_bias=True, 
+                            data_format=DATA_FORMAT)
 
     @tf.function
     def call(self, x):
@@ -599,6 +658,34 @@ class ChannelAttention2D(tf.keras.layers.Layer):
         return config
 
 
+class BlockStack(tf.keras.layers.Layer):
+    """
+    Stack of blocks applied sequentially. If ``jit_compile`` is True, the 
+    forward pass of the whole stack is compiled with XLA as a single cluster,
+    which allows fusing operations across blocks. 
+    """
+    def __init__(self, blocks, jit_compile=False, name=None):
+        super().__init__(name=name)
+        self.blocks = blocks
+        self.jit_compile = jit_compile
+
+    def _forward(self, X, training=None):
+        for block in self.blocks:
+            X = block(X, training=training)
+        return X
+
+    @tf.function(jit_compile=True)
+    def _xla_forward(self, X, training=None):
+        # ``training`` is a Python argument, so tf.function traces one 
+        # function per mode (dropout, batch normalization)
+        return self._forward(X, training)
+
+    def call(self, X, training=None):
+        if self.jit_compile:
+            return self._xla_forward(X, training)
+        return self._forward(X, training)
+
+
 class EncoderBlock(tf.keras.layers.Layer):
     """Encoder block for a decoder-encoder architecture, such as the UNET.
     """
@@ -610,7 +697,7 @@ class EncoderBlock(tf.keras.layers.Layer):
             n_filters, activation=activation, dropout_rate=dropout_rate, 
             dropout_variant=dropout_variant, normalization=normalization, 
             attention=attention)
-        self.maxpool = MaxPooling2D(pool_size=(2, 2))
+        self.maxpool = MaxPooling2D(pool_size=(2, 2), data_format=DATA_FORMAT)
 
     def call(self, X):
         Y = self.conv(X)
@@ -621,30 +708,50 @@ class EncoderBlock(tf.keras.layers.Layer):
 class PadConcat(tf.keras.layers.Layer):
     """Concatenate layer that takes two tensors, if needed it pads to match 
     height and width. 
+
+    If ``padding`` is given as a (pad_h, pad_w) tuple, the first tensor is 
+    zero-padded at the bottom and right with these static amounts (known at 
+    build time), otherwise the padding is inferred from the tensors' shapes 
+    (at run time if the spatial dimensions are unknown).
     """
-    def __init__(self, debug=False, name_suffix=''):
+    def __init__(self, padding=None, debug=False, name_suffix=''):
         super().__init__(name='Concatenate' + name_suffix)
+        self.padding = padding
         self.debug = debug
 
     def call(self, X):
         (t1, t2) = X
+        if self.padding is not None:
+            pad_h, pad_w = self.padding
+            if pad_h > 0 or pad_w > 0:
+                t1 = tf.pad(t1, [[0, 0], [0, pad_h], [0, pad_w], [0, 0]])
+            return tf.concat([t1, t2], axis=-1)
+
         y1 = t1.get_shape().as_list()[1]
         x1 = t1.get_shape().as_list()[2]
         y2 = t2.get_shape().as_list()[1]
         x2 = t2.get_shape().as_list()[2]
 
+        if None in (y1, x1, y2, x2):
+            # unknown spatial dimensions, both tensors are padded to the 
+            # largest height and width at run time
+            shape1 = tf.shape(t1)
+            shape2 = tf.shape(t2)
+            y = tf.maximum(shape1[1], shape2[1])
+            x = tf.maximum(shape1[2], shape2[2])
+            t1 = tf.pad(t1, [[0, 0], [0, y - shape1[1]], [0, x - shape1[2]], [0, 0]])
+            t2 = tf.pad(t2, [[0, 0], [0, y - shape2[1]], [0, x - shape2[2]], [0, 0]])
+            return tf.concat([t1, t2], axis=-1)
+
         if self.debug:
             print(f'input1 ({y1},{x1}) input2 ({y2},{x2})')
 
-        if y2 < y1:
-            t2 = ZeroPadding2D(padding=((0, y1 - y2), (0, 0)))(t2)
-        elif y2 > y1:
-            t1 = ZeroPadding2D(padding=((0, y2 - y1), (0, 0)))(t1)
-
-        if x2 < x1:
-            t2 = ZeroPadding2D(padding=((0, 0), (0, x1 - x2)))(t2)
-        elif x2 > x1:
-            t1 = ZeroPadding2D(padding=((0, 0), (0, x2 - x1)))(t1)
+        # zero-padding at the bottom and right (channels_last tensors)
+        y, x = max(y1, y2), max(x1, x2)
+        if y1 < y or x1 < x:
+            t1 = tf.pad(t1, [[0, 0], [0, y - y1], [0, x - x1], [0, 0]])
+        if y2 < y or x2 < x:
+            t2 = tf.pad(t2, [[0, 0], [0, y - y2], [0, x - x2], [0, 0]])
 
         if self.debug:
             y1 = t1.get_shape().as_list()[1]
@@ -653,7 +760,7 @@ class PadConcat(tf.keras.layers.Layer):
             x2 = t2.get_shape().as_list()[2]
             print(f'output1 ({y1},{x1}) output2 ({y2},{x2})')
 
-        return Concatenate()([t1, t2])
+        return tf.concat([t1, t2], axis=-1)
 
 
 class MCDropout(Dropout):
@@ -689,7 +796,7 @@ def get_dropout_layer(dropout_rate, dropout_variant, dim=2):
             layer = GaussianDropout(dropout_rate)
         elif dropout_variant == 'spatial':
             if dim == 2:
-                layer = SpatialDropout2D(dropout_rate)
+                layer = SpatialDropout2D(dropout_rate, data_format=DATA_FORMAT)
             elif dim == 3:
                 layer = SpatialDropout3D(dropout_rate)
         elif dropout_variant == 'mcdrop':
@@ -698,7 +805,7 @@ def get_dropout_layer(dropout_rate, dropout_variant, dim=2):
             layer = MCGaussianDropout(dropout_rate)
         elif dropout_variant == 'mcspatialdrop':
             if dim == 2:
-                layer = MCSpatialDropout2D(dropout_rate)
+                layer = MCSpatialDropout2D(dropout_rate, data_format=DATA_FORMAT)
             if dim == 3:
                 layer = MCSpatialDropout3D(dropout_rate)
     else:
@@ -1,15 +1,20 @@
+import math
 import tensorflow as tf
 from tensorflow.keras.layers import (Add, Conv2D, Input, Concatenate,  
-                                     UpSampling2D)
+                                     UpSampling2D, Activation)
 from tensorflow.keras.models import Model
 
 from .blocks import (ResidualBlock, ConvBlock, DenseBlock, TransitionBlock,
                      LocalizedConvBlock, SubpixelConvolutionBlock, 
                      DeconvolutionBlock, EncoderBlock, PadConcat, 
-                     get_dropout_layer, ConvNextBlock, ResizeConvolutionBlock)
-from ..utils import checkarg_backbone, checkarg_dropout_variant
- 
+                     get_dropout_layer, ConvNextBlock, ResizeConvolutionBlock,
+                     BlockStack, DATA_FORMAT)
+from .. import MC_DROPOUT_VARIANTS
+from ..utils import (checkarg_backbone, checkarg_dropout_variant, compile_xla,
+                     checkarg_mixed_precision, restore_precision_policy)
 
+
+@restore_precision_policy
 def net_pin(
     backbone_block,
     n_channels, 
@@ -25,7 +30,13 @@ def net_pin(
     attention=False,
     activation='relu',
     output_activation=None,
-    localcon_layer=False):
+    localcon_layer=False,
+    transition_groups=1,
+    oneshot_aggregation=False,
+    mixed_precision=False,
+    xla_compile=False,
+    inference=False,
+    fused_input=False):
     """
     Deep neural network with different backbone architectures (according to the
     ``backbone_block``) and pre-upsampling via interpolation (the samples are 
@@ -79,31 +90,85 @@ def net_pin(
         the values distribution of the output grid.
     localcon_layer : bool, optional
         If True, the LocalizedConvBlock is activated in the output module. 
+    transition_groups : int, optional
+        Maximum number of groups of the 1x1 convolutions in the transition 
+        blocks of the 'densenet' backbone. The largest divisor of 
+        ``transition_groups`` that divides their input and output channels is
+        used. By default 1, dense (ungrouped) 1x1 convolutions. Grouped 
+        convolutions reduce the FLOPs of the projection but may be slow or 
+        unsupported for training on CPUs.
+    oneshot_aggregation : bool, optional
+        If True, the 'densenet' backbone uses one-shot aggregation (as in 
+        VoVNet) instead of dense connectivity: each dense block only receives 
+        the output of the previous block, and the outputs of all the blocks 
+        are concatenated once and projected with a single 1x1 transition 
+        block. This reduces the memory traffic of the growing concatenations,
+        but it's a different network (not densely connected).
+    mixed_precision : bool or str, optional
+        If True or 'mixed_float16', the model is built with the 'mixed_float16'
+        policy (float16 computations on NHWC tensors, which
+        use Tensor Cores on Volta+ GPUs, and float32 variables). If 
+        'mixed_bfloat16', bfloat16 is used instead (Ampere GPUs, TPUs and CPUs
+        with AVX512-BF16/AMX), which does not require loss scaling. The output 
+        layer is kept in float32 for the numerical stability of the loss. The 
+        previous global policy is restored after building the model.
+    xla_compile : bool, optional
+        If True, the model is compiled with XLA (``jit_compile=True``) so that 
+        ``model.predict`` runs fused XLA kernels. See ``dl4ds.compile_xla`` and
+        ``dl4ds.make_xla_infer``. XLA compiles one program per input shape, 
+        therefore with dynamic (None, None) inputs (``localcon_layer=False``) 
+        each new grid size triggers a recompilation. The stack of blocks is 
+        compiled as a single XLA cluster (see dl4ds.BlockStack), except with 
+        ``oneshot_aggregation``.
+    inference : bool, optional
+        If True, the model is built for inference without dropout layers (MC 
+        dropout variants are kept). See ``dl4ds.build_for_inference``.
+    fused_input : bool, optional
+        If True and ``n_aux_channels`` > 0, the model has a single input with 
+        the HR aux channels concatenated (last axis) after the ``n_channels``,
+        instead of two inputs. ``dl4ds.predict`` concatenates the inputs for 
+        such models.
     """
     backbone_block = checkarg_backbone(backbone_block)
     dropout_variant = checkarg_dropout_variant(dropout_variant)
+    if inference and dropout_variant not in MC_DROPOUT_VARIANTS:
+        dropout_rate = 0
+    mixed_precision = checkarg_mixed_precision(mixed_precision)
+    if mixed_precision:
+        tf.keras.mixed_precision.set_global_policy(mixed_precision)
 
     h_hr = hr_size[0]
     w_hr = hr_size[1]
 
     auxvar_array_is_given = True if n_aux_channels > 0 else False
-    if auxvar_array_is_given:
+    fused_input = fused_input and auxvar_array_is_given
+    if fused_input:
+        # single input, the aux channels follow the first n_channels
         if not localcon_layer:
-            s_in = Input(shape=(None, None, n_aux_channels))
+            xs_in = Input(shape=(None, None, n_channels + n_aux_channels))
         else:
-            s_in = Input(shape=(h_hr, w_hr, n_aux_channels))
-
-    if not localcon_layer:  
-        x_in = Input(shape=(None, None, n_channels))
+            xs_in = Input(shape=(h_hr, w_hr, n_channels + n_aux_channels))
+        x_in = xs_in[..., :n_channels]
+        s_in = xs_in[..., n_channels:]
     else:
-        x_in = Input(shape=(h_hr, w_hr, n_channels))
+        if auxvar_array_is_given:
+            if not localcon_layer:
+                s_in = Input(shape=(None, None, n_aux_channels))
+            else:
+                s_in = Input(shape=(h_hr, w_hr, n_aux_channels))
+
+        if not localcon_layer:  
+            x_in = Input(shape=(None, None, n_channels))
+        else:
+            x_in = Input(shape=(h_hr, w_hr, n_channels))
 
     init_n_filters = n_filters
     #---------------------------------------------------------------------------
     # N conv blocks
     if backbone_block == 'convnext':  
         ks = (7, 7)     
-        x = b = Conv2D(n_filters, ks, padding='same')(x_in)
+        x = b = Conv2D(n_filters, ks, padding='same', 
+                       data_format=DATA_FORMAT)(x_in)
         # N convnext blocks
         for i in range(n_blocks):
             n_filters = init_n_filters * (i + 1)
@@ -115,31 +180,67 @@ def net_pin(
         x = Add()([x, b])
     else:
         ks = (3, 3)
-        x = b = Conv2D(n_filters, ks, padding='same')(x_in)
+        x = b = Conv2D(n_filters, ks, padding='same', 
+                       data_format=DATA_FORMAT)(x_in)
         # N conv blocks
+        blocks = []
+        n_channels_b = n_filters
         for i in range(n_blocks):
             n_filters = init_n_filters * (i + 1)
             if backbone_block == 'convnet':
-                b = ConvBlock(
+                blocks.append(ConvBlock(
                     n_filters, activation=activation, dropout_rate=dropout_rate, 
                     dropout_variant=dropout_variant, normalization=normalization, 
-                    attention=attention, name='ConvBlock' + str(i+1))(b)
+                    attention=attention, name='ConvBlock' + str(i+1)))
             elif backbone_block == 'resnet':
-                b = ResidualBlock(
+                blocks.append(ResidualBlock(
                     n_filters, activation=activation, dropout_rate=dropout_rate, 
                     dropout_variant=dropout_variant, normalization=normalization, 
                     use_1x1conv=False if i == 0 else True, attention=attention,
-                    name='ResidualBlock' + str(i+1))(b)
+                    name='ResidualBlock' + str(i+1)))
+            elif backbone_block == 'densenet' and oneshot_aggregation:
+                blocks.append(DenseBlock(
+                    n_filters, activation=activation, dropout_rate=dropout_rate, 
+                    dropout_variant=dropout_variant, normalization=normalization, 
+                    attention=attention, concat_input=False, 
+                    name='DenseBlock' + str(i+1)))
             elif backbone_block == 'densenet':
-                b = DenseBlock(
+                blocks.append(DenseBlock(
                     n_filters, activation=activation, dropout_rate=dropout_rate, 
                     dropout_variant=dropout_variant, normalization=normalization, 
-                    attention=attention, name='DenseBlock' + str(i+1))(b)
-                b = TransitionBlock(b.get_shape()[-1] // 2, 
-                                    name='Transition' + str(i+1))(b)  
-        b = Conv2D(n_filters, ks, padding='same', activation=activation)(b)
-        
-        b = get_dropout_layer(dropout_rate, dropout_variant)(b)
+                    attention=attention, name='DenseBlock' + str(i+1)))
+                # the dense block concatenates its n_filters outputs to its input
+                n_channels_dense = n_channels_b + n_filters
+                n_channels_b = n_channels_dense // 2
+                groups = math.gcd(math.gcd(n_channels_dense, n_channels_b), 
+                                  transition_groups)
+                blocks.append(TransitionBlock(
+                    n_channels_b, groups=groups, name='Transition' + str(i+1)))
+        if backbone_block == 'densenet' and oneshot_aggregation:
+            # one-shot aggregation, the feature maps of all the dense blocks 
+            # are concatenated once and projected with a single 1x1 conv
+            feats = [b]
+            for block in blocks:
+                b = block(b)
+                feats.append(b)
+            b = Concatenate()(feats)
+            groups = math.gcd(math.gcd(b.get_shape()[-1], n_filters), 
+                              transition_groups)
+            b = TransitionBlock(n_filters, groups=groups, name='Transition')(b)
+        elif xla_compile:
+            # the whole stack of blocks is compiled as a single XLA cluster
+            b = BlockStack(blocks, jit_compile=True, name='Backbone')(b)
+        else:
+            for block in blocks:
+                b = block(b)
+        # trailing conv before the long skip connection, skipped for the 
+        # convnet backbone (no skip connection)
+        if backbone_block in ['resnet', 'densenet']:
+            b = Conv2D(n_filters, ks, padding='same', activation=activation, 
+                       data_format=DATA_FORMAT)(b)
+
+        if dropout_rate > 0:
+            b = get_dropout_layer(dropout_rate, dropout_variant)(b)
 
         if backbone_block == 'convnet':
             x = b
@@ -157,19 +258,20 @@ def net_pin(
         x = Concatenate()([x, lws])
 
     #---------------------------------------------------------------------------
-    # HR aux channels are processed
+    # HR aux channels are processed and added (same number of channels as x) 
+    # instead of concatenated, halving the channels of the last blocks
     if auxvar_array_is_given:
         if backbone_block == 'convnext':
             s = ConvNextBlock(
-                filters=n_filters, drop_path=0, normalization=normalization, 
-                use_1x1conv=True, activation=activation, 
-                name='ConvNextBlock_aux')(s_in)
+                filters=x.get_shape()[-1], drop_path=0, 
+                normalization=normalization, use_1x1conv=True, 
+                activation=activation, name='ConvNextBlock_aux')(s_in)
         else:
             s = ConvBlock(
-                filters=n_filters, activation=activation, dropout_rate=0, 
-                normalization=normalization, attention=False,
+                filters=x.get_shape()[-1], activation=activation, 
+                dropout_rate=0, normalization=normalization, attention=False,
                 name='ConvBlock_aux')(s_in) 
-        x = Concatenate()([x, s])    
+        x = Add()([x, s])    
 
     #---------------------------------------------------------------------------
     # Last conv layers
@@ -181,14 +283,24 @@ def net_pin(
     x = ConvBlock(
         n_channels_out, ks_cl1=ks, ks_cl2=ks, activation=output_activation, 
         dropout_rate=0, normalization=normalization, attention=False)(x)     
+    if tf.keras.mixed_precision.global_policy().compute_dtype != 'float32':
+        # output in float32 with mixed precision
+        x = Activation('linear', dtype='float32')(x)
     
     model_name = backbone_block + '_pin'
-    if auxvar_array_is_given:
-        return Model(inputs=[x_in, s_in], outputs=x, name=model_name)  
+    if fused_input:
+        model = Model(inputs=[xs_in], outputs=x, name=model_name)  
+    elif auxvar_array_is_given:
+        model = Model(inputs=[x_in, s_in], outputs=x, name=model_name)  
     else:
-        return Model(inputs=[x_in], outputs=x, name=model_name)
+        model = Model(inputs=[x_in], outputs=x, name=model_name)
 
+    if xla_compile:
+        compile_xla(model)
+    return model
 
+
+@restore_precision_policy
 def unet_pin(
     backbone_block,
     n_channels, 
@@ -202,11 +314,15 @@ def unet_pin(
     dropout_variant=None,
     normalization=None,
     attention=False,
-    decoder_upsampling='rc',
+    decoder_upsampling='spc',
     rc_interpolation='bilinear',
     output_activation=None,
     width_cap=256,
-    localcon_layer=False):
+    localcon_layer=False,
+    mixed_precision=False,
+    xla_compile=False,
+    inference=False,
+    fused_input=False):
     """    
     Deep neural network with UNET (encoder-decoder) backbone and pre-upsampling 
     via interpolation.
@@ -226,24 +342,60 @@ def unet_pin(
         dropout is applied. 
     dropout_variant : str or None, optional
         Type of dropout. Defined in dl4ds.DROPOUT_VARIANTS variable. 
+    decoder_upsampling : str, optional
+        Upsampling in the decoder blocks. One of dl4ds.POSTUPSAMPLING_METHODS. 
+        By default 'spc', the subpixel convolution (Conv2D + depth_to_space) 
+        which avoids the separate (memory-bound) resize kernel of the resize 
+        convolution ('rc').
+    mixed_precision : bool or str, optional
+        If True or 'mixed_float16', the model is built with the 'mixed_float16'
+        policy. If 'mixed_bfloat16', bfloat16 is used instead. The output layer
+        is kept in float32. The previous global policy is restored after 
+        building the model.
+    xla_compile : bool, optional
+        If True, the model is compiled with XLA (``jit_compile=True``) so that 
+        ``model.predict`` runs fused XLA kernels. XLA compiles one program per 
+        input shape, therefore with dynamic (None, None) inputs each new grid 
+        size triggers a recompilation.
+    inference : bool, optional
+        If True, the model is built for inference without dropout layers (MC 
+        dropout variants are kept).
+    fused_input : bool, optional
+        If True and ``n_aux_channels`` > 0, the model has a single input with 
+        the HR aux channels concatenated (last axis) after the ``n_channels``.
     """
     backbone_block = checkarg_backbone(backbone_block)
     dropout_variant = checkarg_dropout_variant(dropout_variant)
+    if inference and dropout_variant not in MC_DROPOUT_VARIANTS:
+        dropout_rate = 0
+    mixed_precision = checkarg_mixed_precision(mixed_precision)
+    if mixed_precision:
+        tf.keras.mixed_precision.set_global_policy(mixed_precision)
     n_blocks = _check_nblocks(hr_size, n_blocks)
     h_hr = hr_size[0]
     w_hr = hr_size[1]
 
     auxvar_array_is_given = True if n_aux_channels > 0 else False
-    if auxvar_array_is_given:
+    fused_input = fused_input and auxvar_array_is_given
+    if fused_input:
+        # single input, the aux channels follow the first n_channels
         if not localcon_layer and h_hr == w_hr:
-            s_in = Input(shape=(None, None, n_aux_channels))
+            xs_in = Input(shape=(None, None, n_channels + n_aux_channels))
         else:
-            s_in = Input(shape=(h_hr, w_hr, n_aux_channels))
-
-    if not localcon_layer and h_hr == w_hr:  
-        x_in = Input(shape=(None, None, n_channels))
+            xs_in = Input(shape=(h_hr, w_hr, n_channels + n_aux_channels))
+        x_in = xs_in[..., :n_channels]
+        s_in = xs_in[..., n_channels:]
     else:
-        x_in = Input(shape=(h_hr, w_hr, n_channels))
+        if auxvar_array_is_given:
+            if not localcon_layer and h_hr == w_hr:
+                s_in = Input(shape=(None, None, n_aux_channels))
+            else:
+                s_in = Input(shape=(h_hr, w_hr, n_aux_channels))
+
+        if not localcon_layer and h_hr == w_hr:  
+            x_in = Input(shape=(None, None, n_channels))
+        else:
+            x_in = Input(shape=(h_hr, w_hr, n_channels))
 
     init_n_filters = n_filters
     #---------------------------------------------------------------------------
@@ -267,10 +419,25 @@ def unet_pin(
         dropout_variant=dropout_variant, name='Bottleneck',
         normalization=None)(x)     # following Isola et al 2016
 
+    # spatial size of the skip connections, used to compute static paddings 
+    # for matching the upsampled tensors (odd sizes are floored by maxpooling).
+    # Only valid when the input shape is fixed, otherwise PadConcat pads the
+    # tensors at run time
+    fixed_input_shape = localcon_layer or h_hr != w_hr
+    skip_sizes = [hr_size]
+    for i in range(n_blocks):
+        skip_sizes.append((skip_sizes[-1][0] // 2, skip_sizes[-1][1] // 2))
+
     # n decoding conv blocks
     n_filters_list = n_filters_list[::-1]
     for j, skip_connection in enumerate(reversed(enconding_filters)):        
         n_filters = n_filters_list[j]
+        k = n_blocks - 1 - j
+        if fixed_input_shape:
+            padding = (skip_sizes[k][0] - 2 * skip_sizes[k + 1][0],
+                       skip_sizes[k][1] - 2 * skip_sizes[k + 1][1])
+        else:
+            padding = None
         if decoder_upsampling == 'spc':
             x = SubpixelConvolutionBlock(2, n_filters, name_suffix=str(j+1))(x)
         elif decoder_upsampling == 'rc':
@@ -278,13 +445,15 @@ def unet_pin(
         elif decoder_upsampling == 'dc':
             x = DeconvolutionBlock(2, n_filters, activation, name_suffix=str(j+1))(x)
 
-        x = PadConcat(name_suffix='_SkipConnection'+str(j+1))([x, skip_connection])        
+        x = PadConcat(padding=padding, 
+                      name_suffix='_SkipConnection'+str(j+1))([x, skip_connection])        
         x = ConvBlock(
             n_filters, activation=activation, dropout_rate=0, 
             dropout_variant=dropout_variant, normalization=normalization, 
             attention=attention, name='DecoderConvBlock' + str(j+1))(x)
 
-    x = get_dropout_layer(dropout_rate, dropout_variant)(x)
+    if dropout_rate > 0:
+        x = get_dropout_layer(dropout_rate, dropout_variant)(x)
 
     #---------------------------------------------------------------------------
     # Localized convolutional layer
@@ -293,11 +462,11 @@ def unet_pin(
         x = Concatenate()([x, lws])
 
     #---------------------------------------------------------------------------
-    # HR aux channels are processed
+    # HR aux channels are processed and added (same number of channels as x)
     if auxvar_array_is_given:
-        s = ConvBlock(n_filters, activation=activation, dropout_rate=0, 
+        s = ConvBlock(x.get_shape()[-1], activation=activation, dropout_rate=0, 
             normalization=normalization, attention=False)(s_in)   
-        x = Concatenate()([x, s])   
+        x = Add()([x, s])   
 
     #---------------------------------------------------------------------------
     # Last conv layers
@@ -307,19 +476,51 @@ def unet_pin(
 
     x = ConvBlock(n_channels_out, activation=output_activation, dropout_rate=0, 
         normalization=normalization, attention=False)(x)     
+    if tf.keras.mixed_precision.global_policy().compute_dtype != 'float32':
+        # output in float32 with mixed precision
+        x = Activation('linear', dtype='float32')(x)
     
     model_name = backbone_block + '_pin'
-    if auxvar_array_is_given:
-        return Model(inputs=[x_in, s_in], outputs=x, name=model_name)  
+    if fused_input:
+        model = Model(inputs=[xs_in], outputs=x, name=model_name)  
+    elif auxvar_array_is_given:
+        model = Model(inputs=[x_in, s_in], outputs=x, name=model_name)  
     else:
-        return Model(inputs=[x_in], outputs=x, name=model_name)
+        model = Model(inputs=[x_in], outputs=x, name=model_name)
+
+    if xla_compile:
+        compile_xla(model)
+    return model
+
+
+def build_for_inference(model_fn, trained_model, **model_params):
+    """Build a model for inference, without (non-MC) dropout layers, and load
+    the weights of a trained model. Dropout layers have no weights, therefore 
+    the weights of ``trained_model`` map one-to-one to the inference model.
+
+    Parameters
+    ----------
+    model_fn : callable
+        Model building function, ``dl4ds.net_pin`` or ``dl4ds.unet_pin``.
+    trained_model : tf.keras.Model
+        Trained model built by ``model_fn`` with the same ``model_params``.
+    **model_params : dict
+        Parameters passed to ``model_fn``.
+    """
+    model_params['inference'] = True
+    model = model_fn(**model_params)
+    model.set_weights(trained_model.get_weights())
+    return model
 
 
 def _check_nblocks(shape, power):  
-    while shape[0] // 2**power < 2 or shape[1] // 2**power < 2:
+    # largest power such that min(shape) // 2**power >= 2, i.e. 
+    # 2**power <= min(shape) // 2
+    max_power = (min(shape[0], shape[1]) // 2).bit_length() - 1
+    if power > max_power:
         msg = f'`n_blocks` is too large, cannot downsample {power} times '
-        msg += f'given the input grid size. Setting `n_blocks` to {power-1}'
+        msg += f'given the input grid size. Setting `n_blocks` to {max_power}'
         print(msg)
-        power -= 1
+        power = max_power
     return power
 
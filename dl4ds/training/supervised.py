@@ -18,7 +18,7 @@ except ImportError:
     has_horovod = False
 
 from .. import POSTUPSAMPLING_METHODS
-from ..utils import Timing
+from ..utils import Timing, compile_xla
 from ..dataloader import DataGenerator
 from ..models import (net_pin, recnet_pin, unet_pin, net_postupsampling, 
                      recnet_postupsampling)
@@ -228,7 +228,8 @@ class SupervisedTrainer(Trainer):
             static_vars=self.static_vars, 
             patch_size=self.patch_size, 
             interpolation=self.interpolation,
-            time_window=self.time_window)
+            time_window=self.time_window,
+            fused_input=self.architecture_params.get('fused_input', False))
         self.ds_train = DataGenerator(
             self.data_train, self.data_train_lr, 
             predictors=self.predictors_train, **datagen_params)
@@ -351,6 +352,11 @@ class SupervisedTrainer(Trainer):
                 # as in Goyan et al 2018 (https://arxiv.org/abs/1706.02677)
                 self.learning_rate *= hvd.size()
         self.optimizer = Adam(learning_rate=self.learning_rate)
+        model_in_float16 = any(layer.dtype_policy.compute_dtype == 'float16' 
+                               for layer in self.model.layers)
+        if model_in_float16:
+            # dynamic loss scaling to avoid float16 gradient underflow
+            self.optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.optimizer)
 
         ### Callbacks
         # early stopping
@@ -393,7 +399,10 @@ class SupervisedTrainer(Trainer):
         if self.steps_per_epoch is not None and has_horovod:
             self.steps_per_epoch = self.steps_per_epoch // hvd.size()
 
-        self.model.compile(optimizer=self.optimizer, loss=self.lossf)
+        if self.architecture_params.get('xla_compile', False):
+            compile_xla(self.model, optimizer=self.optimizer, loss=self.lossf)
+        else:
+            self.model.compile(optimizer=self.optimizer, loss=self.lossf)
         self.fithist = self.model.fit(
             self.ds_train, 
             epochs=self.epochs, 
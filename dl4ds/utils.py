@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import tensorflow as tf
 import xarray as xr
@@ -136,6 +137,43 @@ def checkarg_dropout_variant(dropout_variant):
             return dropout_variant
 
 
+def checkarg_mixed_precision(mixed_precision):
+    """Check the argument ``mixed_precision`` and return the name of the 
+    corresponding mixed precision policy, or None.
+
+    Parameters
+    ----------
+    mixed_precision : bool or str
+        If True, 'mixed_float16' is returned. Otherwise, one of 'mixed_float16'
+        or 'mixed_bfloat16'.
+    """
+    policies = ['mixed_float16', 'mixed_bfloat16']
+    if mixed_precision is None or mixed_precision is False:
+        return None
+    elif mixed_precision is True:
+        return 'mixed_float16'
+    elif isinstance(mixed_precision, str) and mixed_precision in policies:
+        return mixed_precision
+    else:
+        msg = f"`mixed_precision` must be a bool or one of {policies}, got {mixed_precision}"
+        raise ValueError(msg)
+
+
+def restore_precision_policy(model_fn):
+    """Decorator for model building functions. The global mixed precision 
+    policy is restored after building the model, so that a policy set through
+    the ``mixed_precision`` argument only applies to that model.
+    """
+    @functools.wraps(model_fn)
+    def wrapper(*args, **kwargs):
+        previous_policy = tf.keras.mixed_precision.global_policy()
+        try:
+            return model_fn(*args, **kwargs)
+        finally:
+            tf.keras.mixed_precision.set_global_policy(previous_policy)
+    return wrapper
+
+
 def checkarg_loss(loss):
     """Check the argument ``loss``.
 
@@ -199,6 +237,30 @@ def set_visible_gpus(*gpu_indices):
     print(list_devices('logical'))
 
 
+def compile_xla(model, **compile_kwargs):
+    """Compile a tf.keras model with XLA (``jit_compile=True``). The train,
+    test and predict steps are then compiled into fused XLA kernels (e.g.,
+    Conv2D + BiasAdd + activation chains of the convolutional blocks).
+    ``compile_kwargs`` are passed to ``model.compile`` (e.g. ``optimizer`` and
+    ``loss``).
+    """
+    model.compile(jit_compile=True, **compile_kwargs)
+    return model
+
+
+def make_xla_infer(model):
+    """Return a XLA-compiled forward pass of ``model`` in inference mode, to be
+    called as ``infer(x)`` or ``infer(x, s)`` (when the model has an auxiliary
+    input). One concrete function is traced and compiled per input shape
+    (H, W, C) and cached by tf.function, so repeated calls with the same shape
+    do not retrace.
+    """
+    @tf.function(jit_compile=True)
+    def infer(*inputs):
+        return model(list(inputs), training=False)
+    return infer
+
+
 def rank(x):
     return len(x.get_shape().as_list())
 